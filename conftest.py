@@ -0,0 +1,20 @@
+"""Shared pytest fixtures for the send_whatsapp tests."""
+
+from pathlib import Path
+
+import pytest
+from dotenv import load_dotenv
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _load_local_env() -> None:
+    """Load a local .env once per session so tests see the same variables as local runs of the script."""
+    load_dotenv()
+
+
+@pytest.fixture
+def gh_summary_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Point GITHUB_STEP_SUMMARY at a file under tmp_path and return that path."""
+    path = tmp_path / "summary.md"
+    monkeypatch.setenv("GITHUB_STEP_SUMMARY", str(path))
+    return path
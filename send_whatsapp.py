@@ -6,24 +6,39 @@ Environment variables required: WHAPI_TOKEN, WHATSAPP_GROUP_ID, ACTION_TYPE.
 """
 # pyright: reportUnknownVariableType=false, reportMissingTypeArgument=false, reportUnnecessaryCast=false
 
-import json
+from __future__ import annotations
+
+import functools
 import os
+import random
 import re
+import stat
+import string
 import sys
 import time
-from datetime import UTC, datetime
+from datetime import UTC, date, datetime
 from pathlib import Path
-from typing import Any, Literal, cast
+from typing import TYPE_CHECKING, Any, Literal, cast
+
+import orjson
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
 
-import requests
-from dotenv import load_dotenv
+    import requests
 
-load_dotenv()  # take env vars from .env file for local development
+# Take env vars from .env file for local development; Actions runs already have them set.
+# load_dotenv never overrides variables exported in the shell, so it still fills in the rest from .env
+if not os.environ.get("GITHUB_ACTIONS"):
+    from dotenv import load_dotenv
+
+    load_dotenv()
 
 
 def log(msg: str, level: Literal["error", "warning", "notice"] = "notice") -> None:
     """Log with GitHub Actions annotation + UTC timestamp."""
-    timestamp = datetime.now(UTC).isoformat(timespec="milliseconds")
+    now = time.time()
+    timestamp = f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now))}.{int(now % 1 * 1000):03d}+00:00"
     annotation = f"::{level}::[{timestamp}] {msg}"
     output_stream = sys.stderr if level == "error" else sys.stdout
     print(annotation, file=output_stream, flush=True)
@@ -38,68 +53,157 @@ def get_env_var(name: str) -> str:
         sys.exit(1)
 
 
-WHAPI_TOKEN = get_env_var("WHAPI_TOKEN")
-WHATSAPP_GROUP_ID = get_env_var("WHATSAPP_GROUP_ID")
-
 BASE_URL = "https://gate.whapi.cloud"
 HEADERS = {
-    "Authorization": f"Bearer {WHAPI_TOKEN}",
     "Content-Type": "application/json",
+    "Accept-Encoding": "gzip, deflate",  # poll results JSON compresses well; requests decompresses transparently
+    "Connection": "keep-alive",
 }
 
+
+@functools.cache
+def get_session() -> requests.Session:
+    """Return the shared HTTP session, importing requests on first use so holiday runs never load it.
+
+    Reuses keep-alive connections (WHAPI and api.github.com) across calls instead of a fresh TLS handshake per request.
+    The Authorization header is added in main() once WHAPI_TOKEN has been read; GitHub calls override it per request.
+    """
+    import requests  # noqa: PLC0415
+    from requests.adapters import HTTPAdapter  # noqa: PLC0415
+
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=0))
+    return session
+
+
 MAX_RETRIES = 3
+HTTP_TIMEOUT = (3.05, 10)  # (connect, read) seconds; connect slightly above a TCP retransmit window
 INITIAL_BACKOFF = 2  # seconds
+MAX_DELAY = 30  # seconds
+JITTER_FACTOR = 0.5
 MINYAN_THRESHOLD = 10
+ROOM = '06.709 (ממ"ק הצפוני)'
+ROOMS = (ROOM,) * 7  # indexed by datetime.weekday(), Monday=0 ... Sunday=6; same room every day for now
+POLL_TITLE_TMPL = "🕍 מנחה ב-13:30, חדר {room}\n\n_ההודעה נשלחה אוטומטית_"
+POLL_OPTIONS = ('✅ מגיע בל"נ', "📞 תקראו לי אם חסר", "❌ לא מגיע (ישיבה, בבית, חולה, חופש וכו')")
+REMINDER_TMPL = "🔔 תזכורת: אם עוד לא עניתם לסקר - זה הזמן! נתראה ב-13:30, חדר {room}\n\n_ההודעה נשלחה אוטומטית_"
+MINYAN_REACHED_TMPL = "יש מניין! כל מי שרוצה להצטרף יותר ממוזמן. נתראה ב-13:30, חדר {room}\n\n_ההודעה נשלחה אוטומטית_"
+MISSING_PREFIX_TMPL = "חסר {missing} — "
 NOT_FOUND_CODE = 404
 FORBIDDEN_CODE = 403
+CONFLICT_CODE = 409
+UNPROCESSABLE_CODE = 422
+TOO_MANY_REQUESTS_CODE = 429
+SERVER_ERROR_CODE = 500
+LOG_BODY_LIMIT = 512  # max characters of a response body to log
 
 
-def send_request_with_retries(url: str, payload: dict[Any, Any]) -> requests.Response:
-    """Send a POST request with retries and exponential backoff.
+def _backoff_delay(attempt: int) -> float:
+    """Return the exponential backoff delay after the given (1-based) attempt, with random jitter and capped."""
+    jitter = 1 + random.uniform(0, JITTER_FACTOR)  # noqa: S311 - not used for cryptography
+    return min(MAX_DELAY, INITIAL_BACKOFF * (2 ** (attempt - 1)) * jitter)
 
-    Logs warnings and errors if requests fail.
-    Returns the response if successful, otherwise exits the program.
+
+def _retry_delay(attempt: int, response: requests.Response | None) -> float:
+    """Return how long to wait before retrying, preferring the server's Retry-After (in seconds) over backoff.
+
+    Retry-After is sent with 429 and 503 responses; it is capped at MAX_DELAY like the computed backoff.
+    """
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    # Only plain ASCII delay-seconds are honoured; HTTP-dates and junk such as "²" fall back to the backoff
+    if isinstance(retry_after, str) and retry_after.strip().isascii() and retry_after.strip().isdecimal():
+        return min(MAX_DELAY, int(retry_after))
+    return _backoff_delay(attempt)
+
+
+def _is_retryable_status(status_code: int) -> bool:
+    """Return True if an HTTP status is worth retrying (rate limited or server error)."""
+    return status_code == TOO_MANY_REQUESTS_CODE or status_code >= SERVER_ERROR_CODE
+
+
+def _request_with_retries(
+    method: Callable[..., requests.Response],
+    url: str,
+    request_log: str,
+    *,
+    sleep: Callable[[float], object] | None = None,
+    **kwargs: object,
+) -> requests.Response | None:
+    """Call method(url, **kwargs) with retries and exponential backoff; shared by the POST and GET helpers.
+
+    Only rate limiting (429), server errors (5xx) and connection errors are retried; other HTTP errors are
+    returned right away. Returns the OK response, else the last response received (None if every attempt raised).
+    sleep defaults to time.sleep and can be swapped for a fake clock in tests.
     """
-    backoff = INITIAL_BACKOFF
+    last_response: requests.Response | None = None
     for attempt in range(1, MAX_RETRIES + 1):
+        response: requests.Response | None = None
         try:
-            log(f"Sending request to {url} with payload: {json.dumps(payload, ensure_ascii=False)}")
-            response = requests.post(url, headers=HEADERS, json=payload, timeout=10)
+            log(request_log)
+            response = method(url, timeout=HTTP_TIMEOUT, **kwargs)
+            last_response = response
             if response.ok:
-                log(f"Success response: HTTP {response.status_code}, body: {response.text}")
                 return response
-            log(
-                f"Attempt {attempt}: HTTP {response.status_code} - {response.text}",
-                "warning",
-            )
+            log(f"Attempt {attempt}: HTTP {response.status_code} - {response.text[:LOG_BODY_LIMIT]}", "warning")
+            if not _is_retryable_status(response.status_code):
+                log(f"HTTP {response.status_code} is not retryable; giving up.", "warning")
+                return response
         except Exception as exc:
             log(f"Attempt {attempt}: Request failed - {exc}", "warning")
 
         if attempt < MAX_RETRIES:
-            time.sleep(backoff)
-            backoff *= 2
+            (sleep or time.sleep)(_retry_delay(attempt, response))
 
-    log("All retry attempts failed.", "error")
+    log("All retry attempts exhausted.", "warning")
+    return last_response
+
+
+def send_request_with_retries(
+    url: str,
+    payload: dict[Any, Any],
+    *,
+    sleep: Callable[[float], object] | None = None,
+    post: Callable[..., requests.Response] | None = None,
+) -> requests.Response:
+    """Send a POST request with retries and exponential backoff.
+
+    Logs warnings and errors if requests fail.
+    Returns the response if successful, otherwise exits the program.
+    sleep and post default to time.sleep and the shared session's post; tests inject fakes instead.
+    """
+    # Serialize once for every attempt; the session already sends Content-Type: application/json
+    body = orjson.dumps(payload)
+    # RUNNER_DEBUG is set by GitHub Actions when a run is re-run with debug logging enabled
+    if os.environ.get("DEBUG_PAYLOAD") or os.environ.get("RUNNER_DEBUG"):
+        request_log = f"Sending request to {url} with payload: {body.decode()}"
+    else:
+        request_log = f"Sending request to {url}"
+    response = _request_with_retries(post or get_session().post, url, request_log, sleep=sleep, data=body)
+    if response is not None and response.ok:
+        log(f"Success response: HTTP {response.status_code}, body: {response.text[:LOG_BODY_LIMIT]}")
+        return response
+    log("Sending request failed.", "error")
     sys.exit(1)
 
 
-def send_poll(room: str) -> None:
+def send_poll(room: str, group_id: str) -> None:
     """Send a poll message to the WhatsApp group with room and time information.
 
     Persist the poll send response so the reminder run can reference and quote the poll message.
     """
     url = f"{BASE_URL}/messages/poll"
     payload = {
-        "to": WHATSAPP_GROUP_ID,
-        "title": f"🕍 מנחה ב-13:30, חדר {room}\n\n_ההודעה נשלחה אוטומטית_",
-        "options": ['✅ מגיע בל"נ', "📞 תקראו לי אם חסר", "❌ לא מגיע (ישיבה, בבית, חולה, חופש וכו')"],
+        "to": group_id,
+        "title": POLL_TITLE_TMPL.format(room=room),
+        "options": POLL_OPTIONS,
         "count": 1,
     }
     response = send_request_with_retries(url, payload)
     if response:
         log(f"Poll sent successfully: HTTP {response.status_code}")
         try:
-            rjson: Any = response.json()  # type: ignore[reportUnknownVariableType]
+            rjson: Any = orjson.loads(response.content)
             # Persist only the message id via write_last_poll_id
             # (writes .env locally or GitHub variable in Actions)
             msg_id: str | None = None
@@ -121,75 +225,110 @@ def send_poll(room: str) -> None:
             log(f"Failed to persist poll response: {exc}", "warning")
 
 
-def _get_message_with_retries(message_id: str) -> requests.Response | None:
-    """GET a message by ID with retry/backoff semantics. Returns last response or None on exception."""
+def _get_message_with_retries(
+    message_id: str,
+    *,
+    sleep: Callable[[float], object] | None = None,
+    get: Callable[..., requests.Response] | None = None,
+) -> requests.Response | None:
+    """GET a message by ID with retry/backoff semantics. Returns last response or None on exception.
+
+    sleep and get default to time.sleep and the shared session's get; tests inject fakes instead.
+    """
     url = f"{BASE_URL}/messages/{message_id}"
-    backoff = INITIAL_BACKOFF
-    last_response: requests.Response | None = None
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            log(f"Fetching message {message_id} from {url}")
-            response = requests.get(url, headers=HEADERS, timeout=10)
-            last_response = response
-            if response.ok:
-                log(f"Fetched message: HTTP {response.status_code}, body: {response.text}")
-                return response
-            log(f"Attempt {attempt}: HTTP {response.status_code} - {response.text}", "warning")
-        except Exception as exc:
-            log(f"Attempt {attempt}: GET failed - {exc}", "warning")
-        if attempt < MAX_RETRIES:
-            time.sleep(backoff)
-            backoff *= 2
-    log("All GET retry attempts exhausted; returning last response if any.", "warning")
-    return last_response
+    response = _request_with_retries(
+        get or get_session().get, url, f"Fetching message {message_id} from {url}", sleep=sleep
+    )
+    if response is not None and response.ok:
+        log(f"Fetched message: HTTP {response.status_code}, body: {response.text[:LOG_BODY_LIMIT]}")
+    return response
 
 
 def _persist_github_variable(owner: str, repo: str, pat: str, msg_id: str) -> bool:
-    """Try to PATCH the repository variable, and POST it if not found. Returns True on success."""
+    """Create or update the LAST_POLL_MESSAGE_ID repository variable. Returns True on success.
+
+    The workflow passes the variable's current value in as LAST_POLL_MESSAGE_ID, so when that is set the variable
+    exists and a single PATCH does the job (falling back to POST on 404). Otherwise POST (create) first and only
+    PATCH when GitHub reports that the variable already exists.
+    """
     headers = {
         "Authorization": f"Bearer {pat}",
         "Accept": "application/vnd.github+json",
     }
-    patch_url = f"https://api.github.com/repos/{owner}/{repo}/actions/variables/LAST_POLL_MESSAGE_ID"
-    resp = requests.patch(patch_url, headers=headers, json={"value": str(msg_id)}, timeout=10)
+    variables_url = f"https://api.github.com/repos/{owner}/{repo}/actions/variables"
+    patch_url = f"{variables_url}/LAST_POLL_MESSAGE_ID"
+    patch_payload = {"value": str(msg_id)}
+    post_payload = {"name": "LAST_POLL_MESSAGE_ID", "value": str(msg_id)}
+    if os.environ.get("LAST_POLL_MESSAGE_ID"):
+        action = "update"
+        resp = get_session().patch(patch_url, headers=headers, json=patch_payload, timeout=HTTP_TIMEOUT)
+        if resp.status_code == NOT_FOUND_CODE:
+            action = "create"
+            resp = get_session().post(variables_url, headers=headers, json=post_payload, timeout=HTTP_TIMEOUT)
+    else:
+        action = "create"
+        resp = get_session().post(variables_url, headers=headers, json=post_payload, timeout=HTTP_TIMEOUT)
+        if resp.status_code in (CONFLICT_CODE, UNPROCESSABLE_CODE):
+            action = "update"
+            resp = get_session().patch(patch_url, headers=headers, json=patch_payload, timeout=HTTP_TIMEOUT)
     if resp.status_code in (200, 201, 204):
-        log("Updated GitHub Actions variable LAST_POLL_MESSAGE_ID (patched)", "notice")
+        if action == "update":
+            log("Updated GitHub Actions variable LAST_POLL_MESSAGE_ID (patched)", "notice")
+        else:
+            log("Created GitHub Actions variable LAST_POLL_MESSAGE_ID", "notice")
         os.environ["LAST_POLL_MESSAGE_ID"] = str(msg_id)
         return True
-    if resp.status_code == NOT_FOUND_CODE:
-        post_url = f"https://api.github.com/repos/{owner}/{repo}/actions/variables"
-        post_payload = {"name": "LAST_POLL_MESSAGE_ID", "value": str(msg_id)}
-        post_resp = requests.post(post_url, headers=headers, json=post_payload, timeout=10)
-        if post_resp.status_code in (200, 201, 204):
-            log("Created GitHub Actions variable LAST_POLL_MESSAGE_ID", "notice")
-            os.environ["LAST_POLL_MESSAGE_ID"] = str(msg_id)
-            return True
-        if post_resp.status_code == FORBIDDEN_CODE:
-            log(
-                f"Failed to create GitHub variable: HTTP {FORBIDDEN_CODE} - {post_resp.text}.",
-                "warning",
-            )
-        else:
-            log(
-                f"Failed to create GitHub variable: HTTP {post_resp.status_code} - {post_resp.text}",
-                "warning",
-            )
-        return False
     if resp.status_code == FORBIDDEN_CODE:
         log(
-            f"Failed to update GitHub variable: HTTP {FORBIDDEN_CODE} - {resp.text}. "
+            f"Failed to {action} GitHub variable: HTTP {FORBIDDEN_CODE} - {resp.text[:LOG_BODY_LIMIT]}. "
             "This likely means the workflow token lacks 'actions: write' permission; "
             "add the permissions section to your workflow: actions: write",
             "warning",
         )
         return False
     log(
-        f"Failed to update GitHub variable: HTTP {resp.status_code} - {resp.text}",
+        f"Failed to {action} GitHub variable: HTTP {resp.status_code} - {resp.text[:LOG_BODY_LIMIT]}",
         "warning",
     )
     return False
 
 
+def _upsert_env_var(env_path: Path, key: str, value: str | None) -> None:
+    """Set key=value in a .env file (or remove the key when value is None) in a single pass.
+
+    The new content is written to a temp file and moved over the original, so a cancelled run cannot leave
+    a half-written .env behind. A symlinked .env is updated at its target, and the file keeps its permissions
+    (new files are created 0600, since .env holds the API token).
+    """
+    env_path = env_path.resolve()
+    if value is None and not env_path.exists():
+        return
+    content = env_path.read_bytes() if env_path.exists() else b""
+    key_line = re.compile(rb"^[ \t]*" + re.escape(key.encode()) + rb"=.*(?:\n|$)", re.MULTILINE)
+    if value is None:
+        content = key_line.sub(b"", content)
+    else:
+        new_line = f"{key}={value}\n".encode()
+        content, count = key_line.subn(lambda _: new_line, content, count=1)
+        if not count:
+            if content and not content.endswith(b"\n"):
+                content += b"\n"
+            content += new_line
+    mode = stat.S_IMODE(env_path.stat().st_mode) if env_path.exists() else 0o600
+    tmp_path = env_path.with_name(env_path.name + ".tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            os.fchmod(tmp_file.fileno(), mode)  # os.open's mode is masked by umask and ignored for a stale tmp file
+            tmp_file.write(content)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        tmp_path.replace(env_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
 def write_last_poll_id(msg_id: str) -> None:
     """Persist the last poll message id either to GitHub Actions repository variables (when running in Actions).
 
@@ -208,21 +347,7 @@ def write_last_poll_id(msg_id: str) -> None:
             except Exception as exc:
                 log(f"Failed to persist GitHub variable: {exc}", "warning")
         # Fallback: write to .env in repo root
-        env_path = Path(".env")
-        lines = []
-        if env_path.exists():
-            lines = env_path.read_text(encoding="utf-8").splitlines()
-            found = False
-            for i, line in enumerate(lines):
-                if line.strip().startswith("LAST_POLL_MESSAGE_ID="):
-                    lines[i] = f"LAST_POLL_MESSAGE_ID={msg_id}"
-                    found = True
-                    break
-            if not found:
-                lines.append(f"LAST_POLL_MESSAGE_ID={msg_id}")
-        else:
-            lines = [f"LAST_POLL_MESSAGE_ID={msg_id}"]
-        env_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        _upsert_env_var(Path(".env"), "LAST_POLL_MESSAGE_ID", msg_id)
         os.environ["LAST_POLL_MESSAGE_ID"] = str(msg_id)
         log("Wrote LAST_POLL_MESSAGE_ID to .env", "notice")
     except Exception as exc:
@@ -232,24 +357,20 @@ def write_last_poll_id(msg_id: str) -> None:
 def _clear_local_last_poll_id() -> None:
     """Remove LAST_POLL_MESSAGE_ID from local .env and the current process environment."""
     try:
-        env_path = Path(".env")
-        if env_path.exists():
-            lines = env_path.read_text(encoding="utf-8").splitlines()
-            new_lines = [line for line in lines if not line.strip().startswith("LAST_POLL_MESSAGE_ID=")]
-            env_path.write_text("\n".join(new_lines) + ("\n" if new_lines else ""), encoding="utf-8")
+        _upsert_env_var(Path(".env"), "LAST_POLL_MESSAGE_ID", None)
         os.environ.pop("LAST_POLL_MESSAGE_ID", None)
     except Exception as exc:
         log(f"Failed to clear LAST_POLL_MESSAGE_ID from .env: {exc}", "warning")
 
 
-def send_reminder(room: str) -> None:
+def send_reminder(room: str, group_id: str) -> None:
     """Send a reminder message to the WhatsApp group if the poll has not been answered.
 
     If a persisted poll exists, fetch it and count positive responses to vary the body text.
     Always send the reminder quoted as the poll message when possible.
     """
     # Default reminder text
-    default_body = f"🔔 תזכורת: אם עוד לא עניתם לסקר - זה הזמן! נתראה ב-13:30, חדר {room}\n\n_ההודעה נשלחה אוטומטית_"
+    default_body = REMINDER_TMPL.format(room=room)
 
     # Get persisted poll message id from environment; do not rely on last_poll.json.
     poll_id = os.environ.get("LAST_POLL_MESSAGE_ID")
@@ -281,7 +402,7 @@ def send_reminder(room: str) -> None:
     body = _build_reminder_body(positive_count, room, default_body)
 
     payload = {
-        "to": WHATSAPP_GROUP_ID,
+        "to": group_id,
         "body": body,
     }
 
@@ -299,7 +420,7 @@ def _parse_positive_count_from_response(resp: requests.Response) -> int | None:
     try:
         if not resp.ok:
             try:
-                err = resp.json()
+                err = orjson.loads(resp.content)
             except Exception as exc:
                 log(f"Failed to parse error response JSON: {exc}", "warning")
                 err = None
@@ -314,7 +435,7 @@ def _parse_positive_count_from_response(resp: requests.Response) -> int | None:
             else:
                 log(f"GET returned non-OK {resp.status_code}; skipping counts.", "warning")
         else:
-            msg: Any = resp.json()  # type: ignore[reportUnknownVariableType]
+            msg: Any = orjson.loads(resp.content)
             parsed = _extract_positive_count_from_msg(msg)
             result = parsed
     except Exception as exc:
@@ -324,6 +445,12 @@ def _parse_positive_count_from_response(resp: requests.Response) -> int | None:
     return result
 
 
+# Keys that may hold the poll inside a WHAPI message (the message itself is the fallback), and the
+# per-option vote lists to read with the keys that may carry each option's count, in lookup order
+POLL_SECTION_KEYS = ("poll", "interactive")
+POLL_VOTE_PATHS = (("results", ("count",)), ("options", ("votes", "count")))
+
+
 def _extract_positive_count_from_msg(msg: object) -> int | None:
     """Given a parsed message object, extract the positive count if present."""
     if isinstance(msg, dict) and "message" in msg and isinstance(msg["message"], dict):
@@ -331,16 +458,19 @@ def _extract_positive_count_from_msg(msg: object) -> int | None:
     if not isinstance(msg, dict):
         return None
     msg = cast("dict[str, Any]", msg)
-    poll_section = msg.get("poll") or msg.get("interactive") or msg  # type: ignore[reportUnknownVariableType]
+    poll_section = next((msg[key] for key in POLL_SECTION_KEYS if msg.get(key)), msg)  # type: ignore[reportUnknownVariableType]
     if not isinstance(poll_section, dict):
         return None
-    results = poll_section.get("results") or None  # type: ignore[reportUnknownVariableType]
-    if isinstance(results, list):
-        votes = [r.get("count") or 0 for r in results if isinstance(r, dict)]  # type: ignore[reportUnknownVariableType]
-    else:
-        opts = poll_section.get("options") or None  # type: ignore[reportUnknownVariableType]
-        votes = [o.get("votes") or o.get("count") or 0 for o in (opts or []) if isinstance(o, dict)]  # type: ignore[reportUnknownVariableType]
-    return votes[0] if votes else None
+    # Only the first option (positive answer) matters, so stop at the first dict entry
+    for list_key, count_keys in POLL_VOTE_PATHS:
+        entries = poll_section.get(list_key)  # type: ignore[reportUnknownVariableType]
+        if not isinstance(entries, list) or not entries:
+            continue
+        for entry in entries:  # type: ignore[reportUnknownVariableType]
+            if isinstance(entry, dict):
+                return next((entry[key] for key in count_keys if entry.get(key)), 0)  # type: ignore[reportUnknownVariableType]
+        return None
+    return None
 
 
 def _fetch_positive_count(message_id: str) -> int | None:  # type: ignore[reportUnknownVariableType]
@@ -364,34 +494,57 @@ def _build_reminder_body(positive_count: int | None, room: str, default_body: st
     if positive_count is None:
         return default_body
     if positive_count >= MINYAN_THRESHOLD:
-        return f"יש מניין! כל מי שרוצה להצטרף יותר ממוזמן. נתראה ב-13:30, חדר {room}\n\n_ההודעה נשלחה אוטומטית_"
+        return MINYAN_REACHED_TMPL.format(room=room)
     missing = MINYAN_THRESHOLD - (positive_count or 0)
-    return f"חסר {missing} — " + default_body
+    return MISSING_PREFIX_TMPL.format(missing=missing) + default_body
+
 
+def get_room_for_today(now: datetime) -> str:
+    """Return the room Mincha is held in on the given day."""
+    return ROOMS[now.weekday()]
 
-# WHAPI MessageID pattern per their docs
-MSG_ID_PATTERN = re.compile(r"^[A-Za-z0-9._]{4,30}-[A-Za-z0-9._]{4,14}(-[A-Za-z0-9._]{4,10})?(-[A-Za-z0-9._]{2,10})?$")
+
+# WHAPI MessageID pattern per their docs:
+# ^[A-Za-z0-9._]{4,30}-[A-Za-z0-9._]{4,14}(-[A-Za-z0-9._]{4,10})?(-[A-Za-z0-9._]{2,10})?$
+MSG_ID_CHARS = frozenset(string.ascii_letters + string.digits + "._")
+# Allowed (min, max) length of each "-"-separated segment, keyed by segment count.
+# A single optional segment can match either optional group, hence (2, 10) for the third of three.
+MSG_ID_SEGMENT_LENGTHS = {
+    2: ((4, 30), (4, 14)),
+    3: ((4, 30), (4, 14), (2, 10)),
+    4: ((4, 30), (4, 14), (4, 10), (2, 10)),
+}
 
 
 def _is_valid_msg_id(msg_id: str) -> bool:
     """Return True if msg_id matches the WHAPI MessageID pattern."""
-    return bool(MSG_ID_PATTERN.fullmatch(msg_id))
+    parts = msg_id.split("-")
+    lengths = MSG_ID_SEGMENT_LENGTHS.get(len(parts))
+    if lengths is None:
+        return False
+    return all(
+        lo <= len(part) <= hi and MSG_ID_CHARS.issuperset(part) for part, (lo, hi) in zip(parts, lengths, strict=True)
+    )
 
 
-def is_today_holiday(now: datetime) -> str | None:
-    """Return the friendly name if today is a holiday, else None. Looks in assets/holidays_<year>.json."""
-    today = now.date()
-    year = today.year
+@functools.lru_cache(maxsize=4)
+def _load_holidays(year: int) -> dict[date, str]:
+    """Return the parsed assets/holidays_<year>.json map (date -> name), or {} if the file is missing."""
     holidays_file = Path(f"assets/holidays_{year}.json")
     if not holidays_file.exists():
         log(
             f"No holidays file found for {year} (expected: {holidays_file}), proceeding as if today is not a holiday.",
             "warning",
         )
-        return None
-    with holidays_file.open(encoding="utf-8") as f:
-        holiday_map: dict[str, str] = json.load(f)
-    return holiday_map.get(today.isoformat())
+        return {}
+    raw: dict[str, str] = orjson.loads(holidays_file.read_bytes())
+    return {date.fromisoformat(day): name for day, name in raw.items()}
+
+
+def is_today_holiday(now: datetime) -> str | None:
+    """Return the friendly name if today is a holiday, else None. Looks in assets/holidays_<year>.json."""
+    today = now.date()
+    return _load_holidays(today.year).get(today)
 
 
 def write_github_summary(message: str) -> None:
@@ -410,38 +563,49 @@ def write_github_summary(message: str) -> None:
         return
     summary_path = Path(summary_path_str)
     try:
-        with summary_path.open("w", encoding="utf-8") as f:
+        with summary_path.open("a", encoding="utf-8") as f:
             f.write(message + "\n")
     except Exception as exc:
         log(f"Failed to write GitHub summary: {exc}", "warning")
 
 
 # --- Main Action ---
-def main() -> None:
-    """Check if today is a holiday and exits if so. Otherwise, sends either a poll or a reminder message."""
-    # NOTE: Successful execution will overwrite the failure summary
-    write_github_summary("❌ WhatsApp message send failed.")
-    now = datetime.now(UTC)
-    holiday_name = is_today_holiday(now)
-    if holiday_name:
-        log(f"Today is a holiday: {holiday_name}. Skipping WhatsApp message.", "notice")
-        write_github_summary(f"🌴 Today is a holiday: {holiday_name}. No WhatsApp message sent.")
-        sys.exit(0)
-
-    room = '06.709 (ממ"ק הצפוני)'
-
-    action = get_env_var("ACTION_TYPE")
-    if action not in {"poll", "reminder"}:
-        log(f"Invalid ACTION_TYPE: {action}", "error")
-        sys.exit(1)
-    action_type = action
-
-    if action_type == "poll":
-        send_poll(room)
-        write_github_summary("✅ WhatsApp poll message sent successfully.")
-    elif action_type == "reminder":
-        send_reminder(room)
-        write_github_summary("✅ WhatsApp reminder message sent successfully.")
+def main(now: datetime | None = None) -> None:
+    """Check if today is a holiday and exits if so. Otherwise, sends either a poll or a reminder message.
+
+    now defaults to the current UTC time; tests pass a fixed datetime instead.
+    """
+    # Written once on exit; stays the failure message unless a step below records an outcome
+    summary = "❌ WhatsApp message send failed."
+    try:
+        if now is None:
+            now = datetime.now(UTC)
+        holiday_name = is_today_holiday(now)
+        if holiday_name:
+            log(f"Today is a holiday: {holiday_name}. Skipping WhatsApp message.", "notice")
+            summary = f"🌴 Today is a holiday: {holiday_name}. No WhatsApp message sent."
+            sys.exit(0)
+
+        room = get_room_for_today(now)
+
+        # Read the environment once up front and pass values down explicitly
+        token = get_env_var("WHAPI_TOKEN")
+        group_id = get_env_var("WHATSAPP_GROUP_ID")
+        action = get_env_var("ACTION_TYPE")
+        if action not in {"poll", "reminder"}:
+            log(f"Invalid ACTION_TYPE: {action}", "error")
+            sys.exit(1)
+        action_type = action
+        get_session().headers["Authorization"] = f"Bearer {token}"
+
+        if action_type == "poll":
+            send_poll(room, group_id)
+            summary = "✅ WhatsApp poll message sent successfully."
+        elif action_type == "reminder":
+            send_reminder(room, group_id)
+            summary = "✅ WhatsApp reminder message sent successfully."
+    finally:
+        write_github_summary(summary)
 
 
 if __name__ == "__main__":
@@ -1,242 +1,360 @@
 """Unit tests for send_whatsapp.py, covering holiday logic, logging, and WhatsApp message sending functions."""
 
-import json
 import os
+import re
+import stat
+import subprocess
 import sys
-from collections.abc import Callable
 from datetime import UTC, datetime
 from pathlib import Path
-from typing import IO
-from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Literal, cast
+from unittest.mock import MagicMock, call, patch
 
+import orjson
 import pytest
-from dotenv import load_dotenv
 
 import send_whatsapp
 
+if TYPE_CHECKING:
+    import requests
 
-def test_write_github_summary(tmp_path: Path) -> None:
+# Shared response stand-ins: the retry helpers only read these attributes, so no mock bookkeeping is needed
+_OK = cast("requests.Response", SimpleNamespace(ok=True, status_code=200, text="OK", headers={}))
+_FAIL = cast("requests.Response", SimpleNamespace(ok=False, status_code=500, text="Error", headers={}))
+
+# Holiday files written by the is_today_holiday tests, serialized once up front
+_HOLIDAY_JSON_2025 = b'{"2025-08-04":"Test Holiday"}'
+_HOLIDAY_JSON_2024 = b'{"2024-08-04":"Test Holiday"}'
+
+
+@pytest.fixture(autouse=True)
+def _clear_holidays_cache() -> None:
+    """Clear the per-year holidays cache so each test reads its own holiday file."""
+    send_whatsapp._load_holidays.cache_clear()  # type: ignore[reportPrivateUsage] # noqa: SLF001
+
+
+def test_import_does_not_load_requests() -> None:
+    """Test importing send_whatsapp defers the requests import until a session is needed (e.g. holiday runs)."""
+    code = "import sys, send_whatsapp; assert 'requests' not in sys.modules; send_whatsapp.get_session()"
+    code += "; assert 'requests' in sys.modules"
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent, check=True)  # noqa: S603
+
+
+def test_collecting_tests_does_not_load_requests() -> None:
+    """Test collecting this module (decorators included) never builds a session, so requests stays unimported."""
+    code = "import sys, pytest; pytest.main(['-q', '--collect-only', 'test_send_whatsapp.py'])"
+    code += "; assert 'requests' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent, check=True)  # noqa: S603
+
+
+def test_write_github_summary(gh_summary_path: Path) -> None:
     """Test write_github_summary writes the given text to the summary file."""
-    summary_path = tmp_path / "mock_summary.md"
-    test_content = "Success"
-    with patch.dict("os.environ", {"GITHUB_STEP_SUMMARY": str(summary_path)}):
-        send_whatsapp.write_github_summary(test_content)
-        written = summary_path.read_text()
-        assert test_content in written
+    send_whatsapp.write_github_summary("Success")
+    assert "Success" in gh_summary_path.read_text()
+
+
+def test_write_github_summary_appends(gh_summary_path: Path) -> None:
+    """Test write_github_summary appends instead of truncating content written by earlier steps."""
+    gh_summary_path.write_text("Earlier step\n")
+    send_whatsapp.write_github_summary("Success")
+    assert gh_summary_path.read_text() == "Earlier step\nSuccess\n"
 
 
-@patch.dict("os.environ", {"GITHUB_STEP_SUMMARY": "/some/path"})
 @patch("send_whatsapp.log")
-def test_write_github_summary_file_write_failure(mock_log: MagicMock) -> None:
+def test_write_github_summary_file_write_failure(mock_log: MagicMock, monkeypatch: pytest.MonkeyPatch) -> None:
     """Test write_github_summary logs failure if file write fails."""
+    monkeypatch.setenv("GITHUB_STEP_SUMMARY", "/some/path")
     send_whatsapp.write_github_summary("Test message")
     mock_log.assert_called_once()
     args, _kwargs = mock_log.call_args
     assert "Failed to write GitHub summary" in args[0]
 
 
-@patch("time.sleep", return_value=None)  # patch sleep to skip real waiting
-@patch("requests.post")
-def test_send_request_with_retries_backoff_and_retries(mock_post: MagicMock, mock_sleep: MagicMock) -> None:
-    # Simulate two failed attempts then success
+@patch("random.uniform", new=MagicMock(return_value=0))  # no jitter so backoff times are deterministic
+def test_send_request_with_retries_backoff_and_retries() -> None:
     """Test send_request_with_retries sleeps with exponential backoff on failed attempts."""
-    responses = []
-    failed_response = MagicMock()
-    failed_response.ok = False
-    failed_response.status_code = 500
-    failed_response.text = "Error"
-    success_response = MagicMock()
-    success_response.ok = True
-    success_response.status_code = 200
-    success_response.text = "OK"
-    responses = [failed_response, failed_response, success_response]
-    mock_post.side_effect = responses
-    result = send_whatsapp.send_request_with_retries("http://fake.url", {"k": "v"})
+    responses = iter([_FAIL, _FAIL, _OK])
+    slept: list[float] = []
+    result = send_whatsapp.send_request_with_retries(
+        "http://fake.url", {"k": "v"}, sleep=slept.append, post=lambda *_args, **_kwargs: next(responses)
+    )
     assert result.ok
-    # sleep called twice: after first and second failed attempt
-    mock_sleep_call_count = 2
-    assert mock_sleep.call_count == mock_sleep_call_count
-    # check exponential backoff times (2 and 4 seconds)
-    mock_sleep.assert_any_call(2)
-    mock_sleep.assert_any_call(4)
-
-
-@patch("send_whatsapp.write_github_summary")
-@patch("send_whatsapp.send_reminder")
-@patch("send_whatsapp.send_poll")
-@patch("send_whatsapp.datetime")
-def test_main_successful_flow(
-    mock_datetime: MagicMock, mock_poll: MagicMock, mock_reminder: MagicMock, mock_summary: MagicMock
-) -> None:
-    """Test that main writes failed summary first, then success on successful run."""
-    fixed_time_not_holiday = datetime(2000, 1, 1, 0, 0, 0, tzinfo=UTC)
-    mock_datetime.now.return_value = fixed_time_not_holiday
-    mock_poll.return_value = None
-    mock_reminder.return_value = None
-    with patch.dict("os.environ", {"ACTION_TYPE": "poll"}):
-        send_whatsapp.main()
-    mock_summary.assert_any_call("❌ WhatsApp message send failed.")
-    mock_summary.assert_called_with("✅ WhatsApp poll message sent successfully.")
-
-
-def open_test_file(file_path: Path) -> Callable[..., IO[str]]:
-    """Create a mock-compatible function that opens the given file with any arguments.
-
-    This is useful as a mock side_effect for Path.open in unit tests. It ensures
-    that encoding and mode arguments are respected while avoiding type checker errors.
+    # slept after the first and second failed attempts: 2s then 4s
+    assert slept == [2, 4]
+
+
+@pytest.fixture
+def main_session(monkeypatch: pytest.MonkeyPatch) -> SimpleNamespace:
+    """Set the variables main() requires and swap the shared session for a stub, so its auth header cannot leak."""
+    monkeypatch.setenv("WHAPI_TOKEN", "TEST_TOKEN")
+    monkeypatch.setenv("WHATSAPP_GROUP_ID", "TEST_GROUP_ID")
+    session = SimpleNamespace(headers={})
+    monkeypatch.setattr(send_whatsapp, "get_session", lambda: session)
+    return session
+
+
+@pytest.mark.parametrize("action", ["poll", "reminder"])
+def test_main_successful_flow(monkeypatch: pytest.MonkeyPatch, main_session: SimpleNamespace, action: str) -> None:
+    """Test that main sends the requested action and writes only the success summary."""
+    senders = MagicMock()
+    summaries: list[str] = []
+    monkeypatch.setattr(send_whatsapp, "send_poll", senders.poll)
+    monkeypatch.setattr(send_whatsapp, "send_reminder", senders.reminder)
+    monkeypatch.setattr(send_whatsapp, "write_github_summary", summaries.append)
+    monkeypatch.setenv("ACTION_TYPE", action)
+    send_whatsapp.main(now=datetime(2000, 1, 1, tzinfo=UTC))
+    assert senders.mock_calls == [getattr(call, action)(send_whatsapp.ROOM, "TEST_GROUP_ID")]
+    assert main_session.headers == {"Authorization": "Bearer TEST_TOKEN"}
+    assert summaries == [f"✅ WhatsApp {action} message sent successfully."]
+
+
+@pytest.mark.usefixtures("main_session")
+def test_main_writes_failure_summary_when_send_fails(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test main writes the failure summary once if sending exits with an error."""
+    summaries: list[str] = []
+    monkeypatch.setattr(send_whatsapp, "send_poll", MagicMock(side_effect=SystemExit(1)))
+    monkeypatch.setattr(send_whatsapp, "write_github_summary", summaries.append)
+    monkeypatch.setenv("ACTION_TYPE", "poll")
+    with pytest.raises(SystemExit):
+        send_whatsapp.main(now=datetime(2000, 1, 1, tzinfo=UTC))
+    assert summaries == ["❌ WhatsApp message send failed."]
+
+
+@pytest.fixture(scope="session")
+def holiday_tmp_assets(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    """Write assets/holidays_2025.json once per session and return the directory containing assets/.
+
+    Shared read-only: tests that write or delete holiday files use their own tmp_path.
     """
+    root = tmp_path_factory.mktemp("holidays")
+    assets_dir = root / "assets"
+    assets_dir.mkdir()
+    (assets_dir / "holidays_2025.json").write_bytes(_HOLIDAY_JSON_2025)
+    return root
 
-    def opener(*args: object, **kwargs: object) -> IO[str]:
-        # We assume text mode here (which is the default for Path.open)
-        return file_path.open(*args, **kwargs)  # type: ignore[call-overload]
-
-    return opener
 
+@pytest.mark.parametrize(("day", "expected"), [(4, "Test Holiday"), (5, None)])
+def test_is_today_holiday(
+    holiday_tmp_assets: Path, monkeypatch: pytest.MonkeyPatch, day: int, expected: str | None
+) -> None:
+    """Test is_today_holiday returns the holiday name on a holiday and None on any other day."""
+    monkeypatch.chdir(holiday_tmp_assets)
+    assert send_whatsapp.is_today_holiday(datetime(2025, 8, day, tzinfo=UTC)) == expected
 
-def test_is_today_holiday_found(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
-    """Test is_today_holiday returns the holiday name if today is a holiday."""
-    aware_now = datetime(2025, 8, 4, tzinfo=UTC)
 
-    # Prepare the assets directory and holiday file with today's date
-    assets_dir = tmp_path / "assets"
-    assets_dir.mkdir()
-    holiday_file = assets_dir / "holidays_2025.json"
-    holiday_file.write_text(json.dumps({"2025-08-04": "Test Holiday"}))
-    # Change working directory to tmp_path so relative paths work as expected
+def test_is_today_holiday_caches_per_year(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test is_today_holiday parses the holiday file once per year and serves later lookups from the cache."""
+    (tmp_path / "assets").mkdir()
+    holiday_file = tmp_path / "assets" / "holidays_2024.json"
+    holiday_file.write_bytes(_HOLIDAY_JSON_2024)
     monkeypatch.chdir(tmp_path)
-    # Call the function under test
-    result = send_whatsapp.is_today_holiday(aware_now)
-    assert result == "Test Holiday"
+    assert send_whatsapp.is_today_holiday(datetime(2024, 8, 4, tzinfo=UTC)) == "Test Holiday"
+    holiday_file.unlink()
+    assert send_whatsapp.is_today_holiday(datetime(2024, 8, 4, tzinfo=UTC)) == "Test Holiday"
+    assert send_whatsapp.is_today_holiday(datetime(2024, 8, 5, tzinfo=UTC)) is None
 
 
-def test_is_today_holiday_not_found(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
-    """Test is_today_holiday returns None if today is not a holiday."""
-    aware_now = datetime(2025, 8, 4, tzinfo=UTC)
-    # Prepare the assets directory and holiday file with a different date
-    assets_dir = tmp_path / "assets"
-    assets_dir.mkdir()
-    holiday_file = assets_dir / "holidays_2025.json"
-    holiday_file.write_text(json.dumps({"2025-08-05": "Other Holiday"}))  # Not today
-    monkeypatch.chdir(tmp_path)
-    result = send_whatsapp.is_today_holiday(aware_now)
-    assert result is None
+@pytest.mark.parametrize("year", [2026, 2027])
+def test_shipped_holiday_assets_load(year: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test every shipped assets/holidays_<year>.json parses into dates within that year."""
+    monkeypatch.chdir(Path(__file__).parent)
+    holidays = send_whatsapp._load_holidays(year)  # type: ignore[reportPrivateUsage] # noqa: SLF001
+    assert holidays
+    assert all(day.year == year for day in holidays)
 
 
-def test_is_today_holiday_file_missing(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+def test_is_today_holiday_file_missing(holiday_tmp_assets: Path, monkeypatch: pytest.MonkeyPatch) -> None:
     """Test is_today_holiday returns None and logs warning if file is missing."""
-    aware_now = datetime(2025, 8, 4, tzinfo=UTC)
-    # Create the assets directory but do NOT create the holiday file
-    assets_dir = tmp_path / "assets"
-    assets_dir.mkdir()
-    monkeypatch.chdir(tmp_path)
+    monkeypatch.chdir(holiday_tmp_assets)  # only holidays_2025.json exists there
     with patch("send_whatsapp.log") as mock_log:
-        result = send_whatsapp.is_today_holiday(aware_now)
+        result = send_whatsapp.is_today_holiday(datetime(2024, 8, 4, tzinfo=UTC))
     assert result is None
     mock_log.assert_called()
 
 
-@patch("send_whatsapp.write_github_summary")
-@patch("send_whatsapp.send_reminder")
-@patch("send_whatsapp.datetime")
-def test_main_reminder_branch(mock_datetime: MagicMock, mock_reminder: MagicMock, mock_summary: MagicMock) -> None:
-    """Test main writes failed summary first, then success on successful run with reminder branch."""
-    fixed_time_not_holiday = datetime(2000, 1, 1, 0, 0, 0, tzinfo=UTC)
-    mock_datetime.now.return_value = fixed_time_not_holiday
-    mock_reminder.return_value = None
-    with patch.dict("os.environ", {"ACTION_TYPE": "reminder"}):
-        send_whatsapp.main()
-    mock_summary.assert_any_call("❌ WhatsApp message send failed.")
-    mock_summary.assert_called_with("✅ WhatsApp reminder message sent successfully.")
-    mock_reminder.assert_called_once()
+@pytest.mark.parametrize("day", [3, 4, 5, 6, 7, 8, 9])  # Sunday 3 Aug 2025 - Saturday 9 Aug 2025
+def test_get_room_for_today(day: int) -> None:
+    """Test get_room_for_today looks the room up by weekday."""
+    now = datetime(2025, 8, day, tzinfo=UTC)
+    assert send_whatsapp.get_room_for_today(now) == send_whatsapp.ROOMS[now.weekday()] == send_whatsapp.ROOM
 
 
-@patch("send_whatsapp.write_github_summary")
-@patch("send_whatsapp.log")
-@patch("send_whatsapp.is_today_holiday", return_value="Mock Holiday")
-@patch("sys.exit")
-def test_main_exits_if_holiday(
-    mock_exit: MagicMock,
-    mock_is_holiday: MagicMock,
-    mock_log: MagicMock,
-    mock_summary: MagicMock,
-) -> None:
+def test_main_exits_if_holiday(monkeypatch: pytest.MonkeyPatch) -> None:
     """Test main exits early if today is a holiday."""
-    # Make mock_exit raise SystemExit to stop execution like real sys.exit
-    mock_exit.side_effect = SystemExit(0)
-    with pytest.raises(SystemExit) as exc_info, patch.dict("os.environ", {"ACTION_TYPE": "reminder"}):
+    summaries: list[str] = []
+    mock_log = MagicMock()
+    monkeypatch.setattr(send_whatsapp, "is_today_holiday", MagicMock(return_value="Mock Holiday"))
+    monkeypatch.setattr(send_whatsapp, "log", mock_log)
+    monkeypatch.setattr(send_whatsapp, "write_github_summary", summaries.append)
+    monkeypatch.setenv("ACTION_TYPE", "reminder")
+    with pytest.raises(SystemExit) as exc_info:
         send_whatsapp.main()
     assert exc_info.value.code == 0
-    mock_summary.assert_any_call("❌ WhatsApp message send failed.")
-    mock_is_holiday.assert_called_once()
     mock_log.assert_called_with("Today is a holiday: Mock Holiday. Skipping WhatsApp message.", "notice")
-    mock_summary.assert_any_call("🌴 Today is a holiday: Mock Holiday. No WhatsApp message sent.")
-    mock_exit.assert_called_once_with(0)
+    assert summaries == ["🌴 Today is a holiday: Mock Holiday. No WhatsApp message sent."]
 
 
-load_dotenv()  # take environment variables from .env file for local development
-sys.path.insert(0, str(Path(__file__).parent.resolve()))
+@pytest.mark.parametrize(("level", "stream"), [("notice", "out"), ("error", "err")])
+def test_log_stream(capfd: pytest.CaptureFixture[str], level: Literal["error", "notice"], stream: str) -> None:
+    """Test that log writes notices to stdout and errors to stderr."""
+    send_whatsapp.log(f"test {level}", level)
+    captured = capfd.readouterr()
+    assert f"test {level}" in getattr(captured, stream)
 
 
-def test_log_stdout(capsys: pytest.CaptureFixture[str]) -> None:
-    """Test that log outputs to stdout for notice level."""
-    send_whatsapp.log("test notice", "notice")
-    out, _ = capsys.readouterr()
-    assert "test notice" in out
+def test_log_timestamp_format(capfd: pytest.CaptureFixture[str]) -> None:
+    """Test that log prefixes messages with a millisecond-precision UTC ISO 8601 timestamp."""
+    send_whatsapp.log("test timestamp")
+    out, _ = capfd.readouterr()
+    assert re.fullmatch(r"::notice::\[\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}\+00:00\] test timestamp\n", out)
 
 
-def test_log_stderr(capsys: pytest.CaptureFixture[str]) -> None:
-    """Test that log outputs to stderr for error level."""
-    send_whatsapp.log("test error", "error")
-    _, err = capsys.readouterr()
-    assert "test error" in err
+def test_send_request_with_retries_success() -> None:
+    """Test send_request_with_retries returns response on success."""
+    post = MagicMock(return_value=_OK)
+    result = send_whatsapp.send_request_with_retries("http://fake.url", {"key": "value"}, post=post)
+    assert result.ok
+    assert post.call_args.kwargs["data"] == b'{"key":"value"}'
+    assert post.call_args.kwargs["timeout"] == send_whatsapp.HTTP_TIMEOUT
+
+
+def test_send_request_with_retries_failure() -> None:
+    """Test send_request_with_retries exits after MAX_RETRIES failed attempts."""
+    post = MagicMock(return_value=_FAIL)
+    with pytest.raises(SystemExit) as exc_info:
+        send_whatsapp.send_request_with_retries("http://fake.url", {"key": "value"}, sleep=lambda _: None, post=post)
+    assert exc_info.value.code == 1
+    assert post.call_count == send_whatsapp.MAX_RETRIES
+
+
+def test_send_request_with_retries_non_retryable_exits_immediately() -> None:
+    """Test send_request_with_retries does not retry a client error such as HTTP 400."""
+    bad_request = cast("requests.Response", SimpleNamespace(ok=False, status_code=400, text="Bad Request", headers={}))
+    post = MagicMock(return_value=bad_request)
+    slept: list[float] = []
+    with pytest.raises(SystemExit) as exc_info:
+        send_whatsapp.send_request_with_retries("http://fake.url", {"key": "value"}, sleep=slept.append, post=post)
+    assert exc_info.value.code == 1
+    post.assert_called_once()
+    assert slept == []
+
+
+@patch("random.uniform", new=MagicMock(return_value=0.5))  # maximum jitter
+def test_send_request_with_retries_backoff_jitter() -> None:
+    """Test send_request_with_retries adds up to 50% jitter to the exponential backoff."""
+    slept: list[float] = []
+    with pytest.raises(SystemExit):
+        send_whatsapp.send_request_with_retries(
+            "http://fake.url", {"key": "value"}, sleep=slept.append, post=lambda *_args, **_kwargs: _FAIL
+        )
+    assert slept == [3, 6]
+
+
+def test_send_request_with_retries_honours_retry_after() -> None:
+    """Test send_request_with_retries waits for the server's Retry-After (capped at MAX_DELAY) when rate limited."""
+    rate_limited = SimpleNamespace(ok=False, status_code=429, text="Too Many Requests", headers={"Retry-After": "7"})
+    too_long = SimpleNamespace(ok=False, status_code=429, text="Too Many Requests", headers={"Retry-After": "3600"})
+    responses = iter(cast("list[requests.Response]", [rate_limited, too_long, _OK]))
+    slept: list[float] = []
+    result = send_whatsapp.send_request_with_retries(
+        "http://fake.url", {"key": "value"}, sleep=slept.append, post=lambda *_args, **_kwargs: next(responses)
+    )
+    assert result.ok
+    assert slept == [7, send_whatsapp.MAX_DELAY]
 
 
-@patch("requests.post")
-def test_send_request_with_retries_success(mock_post: MagicMock) -> None:
-    """Test send_request_with_retries returns response on success."""
-    mock_response = MagicMock()
-    mock_response.ok = True
-    mock_response.status_code = 200
-    mock_post.return_value = mock_response
+@pytest.mark.parametrize("retry_after", ["²", "soon", "Wed, 21 Oct 2015 07:28:00 GMT"])
+@patch("random.uniform", new=MagicMock(return_value=0))
+def test_send_request_with_retries_ignores_unusable_retry_after(retry_after: str) -> None:
+    """Test a Retry-After that is not plain ASCII seconds (e.g. an HTTP-date) falls back to the exponential backoff."""
+    rate_limited = SimpleNamespace(
+        ok=False, status_code=429, text="Too Many Requests", headers={"Retry-After": retry_after}
+    )
+    responses = iter(cast("list[requests.Response]", [rate_limited, _OK]))
+    slept: list[float] = []
     result = send_whatsapp.send_request_with_retries(
-        "http://fake.url",
-        {"key": "value"},
+        "http://fake.url", {"key": "value"}, sleep=slept.append, post=lambda *_args, **_kwargs: next(responses)
     )
-    assert result is not None
     assert result.ok
+    assert slept == [send_whatsapp.INITIAL_BACKOFF]
 
 
-@patch("requests.post")
-def test_send_request_with_retries_failure(mock_post: MagicMock) -> None:
-    """Test send_request_with_retries exits on repeated failure."""
-    mock_response = MagicMock()
-    mock_response.ok = False
-    mock_response.status_code = 500
-    mock_response.text = "Server Error"
-    mock_post.return_value = mock_response
-    with patch("sys.exit") as mock_exit:
-        send_whatsapp.send_request_with_retries("http://fake.url", {"key": "value"})
-        mock_exit.assert_called_once_with(1)
+def test_get_message_with_retries_returns_not_found_without_retrying() -> None:
+    """Test the message GET shares the retry policy: a 404 is returned for parsing instead of being retried."""
+    not_found = cast("requests.Response", SimpleNamespace(ok=False, status_code=404, text="Not Found", headers={}))
+    get = MagicMock(return_value=not_found)
+    slept: list[float] = []
+    result = send_whatsapp._get_message_with_retries("ABCD-EFGH", sleep=slept.append, get=get)  # type: ignore[reportPrivateUsage] # noqa: SLF001
+    assert result is not_found
+    get.assert_called_once()
+    assert slept == []
 
 
+@pytest.mark.parametrize("name", ["send_poll", "send_reminder"])
 @patch("send_whatsapp.send_request_with_retries")
-def test_send_poll(mock_send: MagicMock) -> None:
-    """Test send_poll calls send_request_with_retries and handles response."""
+def test_send_message(mock_send: MagicMock, name: str) -> None:
+    """Test send_poll and send_reminder call send_request_with_retries and handle the response."""
     mock_response = MagicMock()
     mock_response.status_code = 200
     mock_send.return_value = mock_response
-    send_whatsapp.send_poll("Room A")
+    getattr(send_whatsapp, name)("Room A", "GROUP_ID")
     mock_send.assert_called()
 
 
+@patch("send_whatsapp.write_last_poll_id")
 @patch("send_whatsapp.send_request_with_retries")
-def test_send_reminder(mock_send: MagicMock) -> None:
-    """Test send_reminder calls send_request_with_retries and handles response."""
+def test_send_poll_persists_message_id(mock_send: MagicMock, mock_write_id: MagicMock) -> None:
+    """Test send_poll parses the poll response and persists the returned message id."""
     mock_response = MagicMock()
     mock_response.status_code = 200
+    mock_response.content = orjson.dumps({"sent": True, "message": {"id": "PsrIDamMcQrSYK8-wlMBq53kUCFYFA"}})
     mock_send.return_value = mock_response
-    send_whatsapp.send_reminder("Room A")
-    mock_send.assert_called()
+    send_whatsapp.send_poll("Room A", "GROUP_ID")
+    mock_write_id.assert_called_once_with("PsrIDamMcQrSYK8-wlMBq53kUCFYFA")
+
+
+@pytest.mark.parametrize(
+    ("msg_id", "expected"),
+    [
+        ("PsrIDamMcQrSYK8-wlMBq53kUCFYFA", True),
+        ("ABCD-EFGH", True),
+        ("ABCD-EFGH-ab", True),  # a lone optional segment may be as short as 2
+        ("ABCD-EFGH-IJKL-ab", True),
+        ("A.B_C-1234.5678_90", True),
+        ("ABCD-EFGH-abc-de", False),  # third of four segments needs at least 4 chars
+        ("ABCD", False),
+        ("ABC-EFGH", False),
+        ("ABCD-EFGH-I", False),
+        ("ABCD-EFGH-IJKL-MNOP-QRST", False),
+        ("ABCD-EF GH", False),
+        ("ABCD-EFGH\n", False),
+        ("<MagicMock id='1'>", False),
+        ("", False),
+    ],
+)
+def test_is_valid_msg_id(msg_id: str, *, expected: bool) -> None:
+    """Test _is_valid_msg_id accepts exactly the ids matched by the WHAPI MessageID pattern."""
+    assert send_whatsapp._is_valid_msg_id(msg_id) is expected  # type: ignore[reportPrivateUsage] # noqa: SLF001
+
+
+@pytest.mark.parametrize(
+    ("msg", "expected"),
+    [
+        ({"message": {"poll": {"results": [{"count": 3}, {"count": 5}]}}}, 3),
+        ({"poll": {"results": ["junk", {"count": 7}]}}, 7),
+        ({"poll": {"results": [{"count": None}]}}, 0),
+        ({"poll": {"results": ["junk"], "options": [{"votes": 4}]}}, None),
+        ({"interactive": {"options": [{"votes": 4}, {"votes": 1}]}}, 4),
+        ({"options": [{"count": 2}]}, 2),
+        ({"poll": {"options": []}}, None),
+        ({"poll": "not a dict"}, None),
+        ("not a dict", None),
+    ],
+)
+def test_extract_positive_count_from_msg(msg: object, expected: int | None) -> None:
+    """Test _extract_positive_count_from_msg returns the first option's votes for each supported shape."""
+    assert send_whatsapp._extract_positive_count_from_msg(msg) == expected  # type: ignore[reportPrivateUsage] # noqa: SLF001
 
 
 def test_write_last_poll_id_writes_env_locally(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
@@ -253,20 +371,119 @@ def test_write_last_poll_id_writes_env_locally(tmp_path: Path, monkeypatch: pyte
     assert os.environ.get("LAST_POLL_MESSAGE_ID") == "TESTMSG123"
 
 
-@patch("send_whatsapp.requests.patch")
-def test_write_last_poll_id_calls_github_api(mock_patch: MagicMock, monkeypatch: pytest.MonkeyPatch) -> None:
+def test_write_last_poll_id_updates_existing_env(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """write_last_poll_id should replace an existing LAST_POLL_MESSAGE_ID line in place and keep other entries."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("GITHUB_REPOSITORY", raising=False)
+    monkeypatch.delenv("LAST_POLL_MESSAGE_ID", raising=False)
+    env_path = tmp_path / ".env"
+    env_path.write_text("WHAPI_TOKEN=abc\nLAST_POLL_MESSAGE_ID=OLDMSG1234\nACTION_TYPE=poll")
+    send_whatsapp.write_last_poll_id("NEWMSG5678")
+    assert env_path.read_text(encoding="utf-8") == "WHAPI_TOKEN=abc\nLAST_POLL_MESSAGE_ID=NEWMSG5678\nACTION_TYPE=poll"
+    assert not (tmp_path / ".env.tmp").exists()
+
+
+def test_write_last_poll_id_keeps_env_permissions(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """write_last_poll_id should keep a private .env private and leave no temp file behind."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("GITHUB_REPOSITORY", raising=False)
+    env_path = tmp_path / ".env"
+    private_mode = 0o600
+    env_path.write_text("WHAPI_TOKEN=abc\n")
+    env_path.chmod(private_mode)
+    send_whatsapp.write_last_poll_id("NEWMSG5678")
+    assert stat.S_IMODE(env_path.stat().st_mode) == private_mode
+    assert not (tmp_path / ".env.tmp").exists()
+
+
+def test_write_last_poll_id_updates_symlinked_env_target(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """write_last_poll_id should write through a symlinked .env instead of replacing the link."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("GITHUB_REPOSITORY", raising=False)
+    target = tmp_path / "secrets.env"
+    target.write_text("WHAPI_TOKEN=abc\n")
+    (tmp_path / ".env").symlink_to(target)
+    send_whatsapp.write_last_poll_id("NEWMSG5678")
+    assert (tmp_path / ".env").is_symlink()
+    assert target.read_text(encoding="utf-8") == "WHAPI_TOKEN=abc\nLAST_POLL_MESSAGE_ID=NEWMSG5678\n"
+
+
+def test_clear_local_last_poll_id_removes_only_that_key(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """_clear_local_last_poll_id should drop LAST_POLL_MESSAGE_ID from .env and the environment only."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("LAST_POLL_MESSAGE_ID", "OLDMSG1234")
+    env_path = tmp_path / ".env"
+    env_path.write_text("WHAPI_TOKEN=abc\nLAST_POLL_MESSAGE_ID=OLDMSG1234\nACTION_TYPE=poll\n")
+    send_whatsapp._clear_local_last_poll_id()  # type: ignore[reportPrivateUsage] # noqa: SLF001
+    assert env_path.read_text(encoding="utf-8") == "WHAPI_TOKEN=abc\nACTION_TYPE=poll\n"
+    assert "LAST_POLL_MESSAGE_ID" not in os.environ
+
+
+def test_write_last_poll_id_calls_github_api(monkeypatch: pytest.MonkeyPatch) -> None:
     """When running in Actions, write_last_poll_id should call the GitHub Actions Variables API."""
+    session = MagicMock()
+    session.patch.return_value = MagicMock(status_code=204)
+    monkeypatch.setattr(send_whatsapp, "get_session", lambda: session)
     monkeypatch.setenv("GITHUB_REPOSITORY", "owner/repo")
     monkeypatch.setenv("ACTIONS_VARIABLE_MGMT_PAT", "fake-token")
-    mock_resp = MagicMock()
-    mock_resp.status_code = 201
-    mock_patch.return_value = mock_resp
+    # The workflow passes the existing variable's value in, so the variable is updated directly
+    monkeypatch.setenv("LAST_POLL_MESSAGE_ID", "MSGID-GH-0")
     send_whatsapp.write_last_poll_id("MSGID-GH-1")
-    mock_patch.assert_called_once()
+    session.patch.assert_called_once()
+    session.post.assert_not_called()
     # verify env var was also set for current process
     assert os.environ.get("LAST_POLL_MESSAGE_ID") == "MSGID-GH-1"
 
 
+@pytest.mark.parametrize(("post_status", "patch_calls"), [(201, 0), (409, 1), (422, 1)])
+def test_write_last_poll_id_creates_github_variable_first_when_unset(
+    monkeypatch: pytest.MonkeyPatch, post_status: int, patch_calls: int
+) -> None:
+    """Without a current value, write_last_poll_id should POST first and PATCH only if the variable exists."""
+    session = MagicMock()
+    session.post.return_value = MagicMock(status_code=post_status)
+    session.patch.return_value = MagicMock(status_code=204)
+    monkeypatch.setattr(send_whatsapp, "get_session", lambda: session)
+    monkeypatch.setenv("GITHUB_REPOSITORY", "owner/repo")
+    monkeypatch.setenv("ACTIONS_VARIABLE_MGMT_PAT", "fake-token")
+    monkeypatch.delenv("LAST_POLL_MESSAGE_ID", raising=False)
+    send_whatsapp.write_last_poll_id("MSGID-GH-2")
+    session.post.assert_called_once()
+    assert session.patch.call_count == patch_calls
+    assert os.environ.get("LAST_POLL_MESSAGE_ID") == "MSGID-GH-2"
+
+
+def test_persist_github_variable_creates_after_patch_not_found(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A PATCH that finds no variable (404) should fall back to POST and report success."""
+    session = MagicMock()
+    session.patch.return_value = MagicMock(status_code=404)
+    session.post.return_value = MagicMock(status_code=201)
+    monkeypatch.setattr(send_whatsapp, "get_session", lambda: session)
+    monkeypatch.setenv("LAST_POLL_MESSAGE_ID", "MSGID-GH-0")
+    assert send_whatsapp._persist_github_variable("owner", "repo", "fake-token", "MSGID-GH-3")  # type: ignore[reportPrivateUsage] # noqa: SLF001
+    session.patch.assert_called_once()
+    session.post.assert_called_once()
+    assert session.post.call_args.kwargs["json"] == {"name": "LAST_POLL_MESSAGE_ID", "value": "MSGID-GH-3"}
+    assert os.environ.get("LAST_POLL_MESSAGE_ID") == "MSGID-GH-3"
+
+
+@pytest.mark.parametrize(("status", "hint"), [(403, "actions: write"), (500, "HTTP 500")])
+def test_persist_github_variable_reports_failure(monkeypatch: pytest.MonkeyPatch, status: int, hint: str) -> None:
+    """A failed update should return False, log the reason (with a permissions hint on 403) and keep the old id."""
+    session = MagicMock()
+    session.patch.return_value = MagicMock(status_code=status, text="error body")
+    mock_log = MagicMock()
+    monkeypatch.setattr(send_whatsapp, "get_session", lambda: session)
+    monkeypatch.setattr(send_whatsapp, "log", mock_log)
+    monkeypatch.setenv("LAST_POLL_MESSAGE_ID", "MSGID-GH-0")
+    assert not send_whatsapp._persist_github_variable("owner", "repo", "fake-token", "MSGID-GH-4")  # type: ignore[reportPrivateUsage] # noqa: SLF001
+    session.post.assert_not_called()
+    message, level = mock_log.call_args.args
+    assert hint in message
+    assert level == "warning"
+    assert os.environ.get("LAST_POLL_MESSAGE_ID") == "MSGID-GH-0"
+
+
 @patch("send_whatsapp.send_request_with_retries")
 @patch("send_whatsapp._get_message_with_retries")
 def test_send_reminder_uses_get_counts(
@@ -276,12 +493,13 @@ def test_send_reminder_uses_get_counts(
     monkeypatch.setenv("LAST_POLL_MESSAGE_ID", "PsrIDamMcQrSYK8-wlMBq53kUCFYFA")
     # Mock GET response to include poll results with count=3
     mock_get_resp = MagicMock()
-    mock_get_resp.json.return_value = {"message": {"poll": {"results": [{"count": 3}, {"count": 0}, {"count": 0}]}}}
+    mock_get_resp.ok = True
+    mock_get_resp.content = orjson.dumps({"message": {"poll": {"results": [{"count": 3}, {"count": 0}, {"count": 0}]}}})
     mock_get.return_value = mock_get_resp
     mock_send_resp = MagicMock()
     mock_send_resp.status_code = 200
     mock_send.return_value = mock_send_resp
-    send_whatsapp.send_reminder("Room A")
+    send_whatsapp.send_reminder("Room A", "GROUP_ID")
     mock_send.assert_called_once()
     args, _ = mock_send.call_args
     # send_request_with_retries called with (url, payload)